@@ -10,15 +10,18 @@ def get_sorted_tiles_for_attack(strategic):
     for x in range(strategic.get_game_width()):
         for y in range(strategic.get_game_height()):
             coordinate = common_types.Coordinates(x, y)
-            danger = strategic.estimate_tile_danger(coordinate)
-            if danger == 1:
+            country = strategic.get_tile_country(coordinate)
+            if country is None:
                 unclaimed_tiles.append(coordinate)
-            elif danger == 2:
+            elif country != strategic.get_my_country():
                 enemy_tiles.append(coordinate)
 
     random.shuffle(unclaimed_tiles)
     random.shuffle(enemy_tiles)
-    return enemy_tiles + unclaimed_tiles
+    tiles = enemy_tiles + unclaimed_tiles
+    # Stable sort, so tiles of equal value keep the enemy-first random order.
+    tiles.sort(key=strategic.get_tile_attack_value, reverse=True)
+    return tiles
 
 
 def builder_decide(strategic, builder):
@@ -49,3 +52,8 @@ def do_turn(strategic):
                 break
     except Exception as e:
         pass
+    finally:
+        try:
+            strategic.resolve_moves()
+        except Exception as e:
+            pass
@@ -1,3 +1,4 @@
+import collections
 import imp
 import random
 from typing import Tuple, List
@@ -100,7 +101,279 @@ class TurnContext(object):
         return [command.to_dict() for command in self._commands]
 
 
-def move_tank_to_destination(tank, dest):
+NEIGHBOURS = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+
+
+class TerritoryMap(object):
+    """Keeps the connected components of every country's tiles between turns.
+
+    Components are kept in a union-find structure keyed by (x, y) tuples, and
+    are updated incrementally from the tiles that changed hands since the last
+    turn. A union-find cannot split a component, so a country that lost tiles
+    has only its own tiles rebuilt. Unclaimed tiles are not tracked.
+    """
+
+    def __init__(self):
+        super(TerritoryMap, self).__init__()
+        self.owners = {}
+        self._tiles = {}
+        self._parent = {}
+        self._size = {}
+        self._frontier = {}
+        self._choke_points = {}
+        self._joining_tiles = {}
+
+    def update(self, context):
+        """Applies the tiles that changed owner since the previous update."""
+        changed = []
+        lost = set()
+        for loc, tile in context.tiles.items():
+            old_country = self.owners.get(loc)
+            if loc in self.owners and old_country == tile.country:
+                continue
+            if old_country is not None:
+                self._tiles[old_country].discard(loc)
+                self._frontier[old_country].discard(loc)
+                lost.add(old_country)
+            self.owners[loc] = tile.country
+            changed.append(loc)
+        if not changed:
+            return
+
+        for loc in changed:
+            self._parent.pop(loc, None)
+            self._size.pop(loc, None)
+        for loc in changed:
+            country = self.owners[loc]
+            if country is None:
+                continue
+            self._tiles.setdefault(country, set()).add(loc)
+            self._frontier.setdefault(country, set())
+            self._parent[loc] = loc
+            self._size[loc] = 1
+            if country not in lost:
+                self._union_with_neighbours(loc)
+        for country in lost:
+            for loc in self._tiles[country]:
+                self._parent[loc] = loc
+                self._size[loc] = 1
+            for loc in self._tiles[country]:
+                self._union_with_neighbours(loc)
+
+        for loc in changed:
+            self._update_frontier(loc)
+            for neighbour in self._neighbours(loc):
+                self._update_frontier(neighbour)
+        for loc in changed:
+            self._choke_points.pop(self.owners[loc], None)
+        for country in lost:
+            self._choke_points.pop(country, None)
+        self._joining_tiles.clear()
+
+    def _neighbours(self, loc):
+        for dx, dy in NEIGHBOURS:
+            neighbour = (loc[0] + dx, loc[1] + dy)
+            if neighbour in self.owners:
+                yield neighbour
+
+    def _find(self, loc):
+        root = loc
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[loc] != root:
+            self._parent[loc], loc = root, self._parent[loc]
+        return root
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+
+    def _union_with_neighbours(self, loc):
+        for neighbour in self._neighbours(loc):
+            if self.owners[neighbour] == self.owners[loc] and neighbour in self._parent:
+                self._union(loc, neighbour)
+
+    def _update_frontier(self, loc):
+        country = self.owners[loc]
+        if country is None:
+            return
+        if any(self.owners[neighbour] != country for neighbour in self._neighbours(loc)):
+            self._frontier[country].add(loc)
+        else:
+            self._frontier[country].discard(loc)
+
+    def component_root(self, loc):
+        """Returns an identifier of the component of the given tile, or None if unclaimed."""
+        if self.owners.get(loc) is None:
+            return None
+        return self._find(loc)
+
+    def component_size(self, loc):
+        """Returns the number of tiles connected to the given tile, or 0 if unclaimed."""
+        if self.owners.get(loc) is None:
+            return 0
+        return self._size[self._find(loc)]
+
+    def get_components(self, country):
+        """Returns a dict mapping component identifiers of the country to their sizes."""
+        return {root: self._size[root] for root in {self._find(loc) for loc in self._tiles.get(country, ())}}
+
+    def get_frontier(self, country):
+        """Returns the tiles of the country that touch a tile it does not own."""
+        return frozenset(self._frontier.get(country, ()))
+
+    def is_on_frontier(self, loc):
+        """Returns True if the given tile touches a tile its owner does not own."""
+        country = self.owners.get(loc)
+        return country is not None and loc in self._frontier[country]
+
+    def get_choke_points(self, country):
+        """Returns the tiles whose capture would split a component of the country.
+
+        These are the articulation points of the country's tiles. They are
+        computed on demand, and cached until the country's tiles change.
+        """
+        if country not in self._choke_points:
+            self._choke_points[country] = frozenset(self._find_articulation_points(self._tiles.get(country, set())))
+        return self._choke_points[country]
+
+    def _find_articulation_points(self, tiles):
+        # Iterative Tarjan, since a large territory would overflow the recursion limit.
+        order = {}
+        low = {}
+        result = set()
+        for start in tiles:
+            if start in order:
+                continue
+            order[start] = low[start] = len(order)
+            root_children = 0
+            stack = [(start, None, self._neighbours(start))]
+            while stack:
+                loc, parent, neighbours = stack[-1]
+                for neighbour in neighbours:
+                    if neighbour not in tiles or neighbour == parent:
+                        continue
+                    if neighbour in order:
+                        low[loc] = min(low[loc], order[neighbour])
+                        continue
+                    order[neighbour] = low[neighbour] = len(order)
+                    stack.append((neighbour, loc, self._neighbours(neighbour)))
+                    break
+                else:
+                    stack.pop()
+                    if parent is None:
+                        continue
+                    low[parent] = min(low[parent], low[loc])
+                    if parent == start:
+                        root_children += 1
+                    elif low[loc] >= order[parent]:
+                        result.add(parent)
+            if root_children > 1:
+                result.add(start)
+        return result
+
+    def get_joining_tiles(self, country):
+        """Returns the tiles not owned by the country that touch two or more of its components."""
+        if country in self._joining_tiles:
+            return self._joining_tiles[country]
+        result = set()
+        for loc in self._frontier.get(country, ()):
+            for neighbour in self._neighbours(loc):
+                if self.owners[neighbour] == country or neighbour in result:
+                    continue
+                roots = {self._find(n) for n in self._neighbours(neighbour) if self.owners[n] == country}
+                if len(roots) > 1:
+                    result.add(neighbour)
+        self._joining_tiles[country] = frozenset(result)
+        return self._joining_tiles[country]
+
+
+territory = TerritoryMap()
+
+
+# Not an engine rule, but our own policy, so that our pieces spread out instead
+# of piling onto one tile. Pieces that start the turn above it, such as on the
+# tile they were built on, may stay there; the tile just takes no more arrivals.
+MAX_PIECES_PER_TILE = 2
+
+
+class MoveResolver(object):
+    """Collects the moves planned for this turn and issues them together.
+
+    Each of our pieces keeps only its last planned step. When resolved, every
+    mover first leaves its tile in a per-tile occupancy table of our pieces, and
+    then arrivals are accepted in plan order while their tile is below
+    MAX_PIECES_PER_TILE. A blocked mover returns to its tile, and if that
+    overfills the tile, the last arrival there is blocked in turn. A piece is
+    blocked at most once, so this stays linear in the number of moves.
+    """
+
+    def __init__(self, context):
+        super(MoveResolver, self).__init__()
+        self._context = context
+        self._planned = {}
+
+    def plan(self, piece, coordinate, command_id=None):
+        """Plans a one tile step of one of our pieces, replacing its earlier plan.
+
+        If command_id is given, that attack command's status is updated once the
+        move is resolved. Pieces of other countries are ignored.
+        """
+        if piece.id not in self._context.my_pieces:
+            return
+        self._planned[piece.id] = (piece, coordinate, command_id)
+
+    def resolve(self):
+        """Issues the planned moves that fit, and returns the IDs of the pieces that moved."""
+        occupancy = {}
+        for piece in self._context.my_pieces.values():
+            loc = (piece.tile.coordinates.x, piece.tile.coordinates.y)
+            occupancy[loc] = occupancy.get(loc, 0) + 1
+        movers = {}
+        for piece_id, (piece, coordinate, command_id) in self._planned.items():
+            loc = (coordinate.x, coordinate.y)
+            if loc not in self._context.tiles:
+                continue
+            source = (piece.tile.coordinates.x, piece.tile.coordinates.y)
+            occupancy[source] -= 1
+            movers[piece_id] = (source, loc)
+
+        arrivals = {}
+        blocked = collections.deque()
+        for piece_id, (source, loc) in movers.items():
+            if occupancy.get(loc, 0) < MAX_PIECES_PER_TILE:
+                occupancy[loc] = occupancy.get(loc, 0) + 1
+                arrivals.setdefault(loc, []).append(piece_id)
+            else:
+                blocked.append(piece_id)
+        while blocked:
+            source, loc = movers.pop(blocked.popleft())
+            occupancy[source] += 1
+            if occupancy[source] > MAX_PIECES_PER_TILE and arrivals.get(source):
+                occupancy[source] -= 1
+                blocked.append(arrivals[source].pop())
+
+        for piece_id in movers:
+            piece, coordinate, command_id = self._planned[piece_id]
+            piece.move(coordinate)
+        for piece_id, (piece, coordinate, command_id) in self._planned.items():
+            if command_id is None or tank_to_attacking_command.get(piece_id) != command_id:
+                continue
+            prev_command = commands[int(command_id)]
+            estimated_turns = prev_command.estimated_turns
+            if piece_id in movers:
+                estimated_turns -= 1
+            commands[int(command_id)] = CommandStatus.in_progress(command_id, prev_command.elapsed_turns + 1, estimated_turns)
+        self._planned.clear()
+        return set(movers)
+
+
+def move_tank_to_destination(tank, dest, moves):
     """Returns True if the tank's mission is complete."""
     command_id = tank_to_attacking_command[tank.id]
     if dest is None:
@@ -120,9 +393,7 @@ def move_tank_to_destination(tank, dest):
         commands[int(command_id)] = CommandStatus.success(command_id)
         del tank_to_attacking_command[tank.id]
         return True
-    tank.move(new_coordinate)
-    prev_command = commands[int(command_id)]
-    commands[int(command_id)] = CommandStatus.in_progress(command_id, prev_command.elapsed_turns + 1, prev_command.estimated_turns - 1)
+    moves.plan(tank, new_coordinate, command_id)
     return False
 
 
@@ -130,13 +401,15 @@ class MyStrategicApi(strategic_api.StrategicApi):
     def __init__(self, *args, **kwargs):
         super(MyStrategicApi, self).__init__(*args, **kwargs)
         self.context: TurnContext = self.context
+        territory.update(self.context)
+        self.moves = MoveResolver(self.context)
         to_remove = set()
         for tank_id, destination in tank_to_coordinate_to_attack.items():
             tank = self.context.my_pieces.get(tank_id)
             if tank is None:
                 to_remove.add(tank_id)
                 continue
-            if move_tank_to_destination(tank, destination):
+            if move_tank_to_destination(tank, destination, self.moves):
                 to_remove.add(tank_id)
         for tank_id in to_remove:
             del tank_to_coordinate_to_attack[tank_id]
@@ -228,6 +501,26 @@ class MyStrategicApi(strategic_api.StrategicApi):
                 self.context.log("danger = " + str(danger))
                 return danger
 
+    def get_tile_attack_value(self, destination) -> int:
+        """Returns how much capturing the given tile hurts enemy territory shape.
+
+        Choke points of an enemy territory are worth the most, then tiles that
+        join two of our components, then tiles on an enemy frontier.
+        """
+        loc = (destination.x, destination.y)
+        country = territory.owners.get(loc)
+        if country == self.get_my_country():
+            return 0
+        value = 0
+        if country is not None:
+            if loc in territory.get_choke_points(country):
+                value += 4
+            if territory.is_on_frontier(loc):
+                value += 1
+        if loc in territory.get_joining_tiles(self.get_my_country()):
+            value += 2
+        return value
+
     def gather_intelligence(self, pieces, destination, radius=2):
         # self.context.log("[*] gather_intelligence: enter")
         """Get intelligence of the area around the destination, using `pieces`.
@@ -246,31 +539,18 @@ class MyStrategicApi(strategic_api.StrategicApi):
     def move_builder(self, piece, dest):
         # self.context.log("[*] move_builder: enter")
         coor = piece.tile.coordinates
-        for i in range(5):
-            if dest.x < coor.x:
-                new_coordinate = common_types.Coordinates(coor.x - 1, coor.y)
-            elif dest.x > coor.x:
-                new_coordinate = common_types.Coordinates(coor.x + 1, coor.y)
-            elif dest.y < coor.y:
-                new_coordinate = common_types.Coordinates(coor.x, coor.y - 1)
-            elif dest.y > coor.y:
-                new_coordinate = common_types.Coordinates(coor.x, coor.y + 1)
-            else:
-                break
-            self.context.log("new coordinates = " + str(new_coordinate))
-            piece.move(new_coordinate)
-            if dest.y < coor.y:
-                new_coordinate = common_types.Coordinates(coor.x, coor.y - 1)
-            elif dest.y > coor.y:
-                new_coordinate = common_types.Coordinates(coor.x, coor.y + 1)
-            elif dest.x < coor.x:
-                new_coordinate = common_types.Coordinates(coor.x - 1, coor.y)
-            elif dest.x > coor.x:
-                new_coordinate = common_types.Coordinates(coor.x + 1, coor.y)
-            else:
-                break
-            self.context.log("new coordinates = " + str(new_coordinate))
-            piece.move(new_coordinate)
+        if dest.x < coor.x:
+            new_coordinate = common_types.Coordinates(coor.x - 1, coor.y)
+        elif dest.x > coor.x:
+            new_coordinate = common_types.Coordinates(coor.x + 1, coor.y)
+        elif dest.y < coor.y:
+            new_coordinate = common_types.Coordinates(coor.x, coor.y - 1)
+        elif dest.y > coor.y:
+            new_coordinate = common_types.Coordinates(coor.x, coor.y + 1)
+        else:
+            return
+        self.context.log("new coordinates = " + str(new_coordinate))
+        self.moves.plan(piece, new_coordinate)
         # self.context.log("[*] move_builder: return")
 
     def build_piece(self, builder, piece_type):
@@ -384,7 +664,7 @@ class MyStrategicApi(strategic_api.StrategicApi):
                 self.context.log("[*] collect_money: return")
                 return
             else:
-                builder.move(common_types.Coordinates(dest[0], dest[1]))
+                self.moves.plan(builder, common_types.Coordinates(dest[0], dest[1]))
         else:
             n_tile = self.context.tiles[(loc.x, loc.y)]
             m = n_tile.money
@@ -396,6 +676,10 @@ class MyStrategicApi(strategic_api.StrategicApi):
             # self.context.log("[*] collect_money: return")
         return curr_money >= amount
 
+    def resolve_moves(self):
+        """Issues all the moves planned this turn. Should be called once, at the end of the turn."""
+        return self.moves.resolve()
+
     def get_game_width(self):
         return self.context.game_width
 
@@ -405,6 +689,9 @@ class MyStrategicApi(strategic_api.StrategicApi):
     def get_my_country(self):
         return self.context.my_country
 
+    def get_tile_country(self, destination):
+        return self.context.tiles[(destination.x, destination.y)].country
+
     def list_all_countries(self):
         return self.context.all_countries
 